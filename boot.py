@@ -1,3 +1,4 @@
+import json
 import network
 import time
 
@@ -5,7 +6,73 @@ WIFI_SSID = "Boys Fort"
 WIFI_PW = "idontknow"
 
 CONNECT_TIMEOUT_MS = 15000
+CACHED_CONNECT_TIMEOUT_MS = 3000
 SLEEP_STEP_MS = 200
+WIFI_CACHE_FILE = "wifi_cache.json"
+
+
+def load_cached_bssid():
+    try:
+        with open(WIFI_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+        if cache.get("ssid") != WIFI_SSID:
+            return None
+        return bytes.fromhex(cache["bssid"])
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def save_cached_bssid(bssid):
+    try:
+        with open(WIFI_CACHE_FILE, "w") as f:
+            json.dump({"ssid": WIFI_SSID, "bssid": bssid.hex()}, f)
+    except OSError as e:
+        print("Failed to save Wi-Fi cache:", e)
+
+
+def forget_cached_bssid():
+    try:
+        import os
+
+        os.remove(WIFI_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def strongest_bssid(wlan):
+    # Scan once ourselves so we know which access point we joined; this
+    # port's WLAN.config() cannot report the BSSID after a plain connect().
+    # The extra scan makes a cache-miss boot slower than a plain connect.
+    best = None
+    best_rssi = -1000
+    try:
+        for entry in wlan.scan():
+            if entry[0] == WIFI_SSID.encode() and entry[3] > best_rssi:
+                best = entry[1]
+                best_rssi = entry[3]
+    except OSError as e:
+        print("Wi-Fi scan failed:", e)
+    return best
+
+
+# Statuses the radio will not recover from by waiting longer.
+FAILED_STATUSES = [
+    getattr(network, name)
+    for name in ("STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_CONNECT_FAIL")
+    if hasattr(network, name)
+]
+
+
+def wait_connected(wlan, timeout_ms):
+    start = time.ticks_ms()
+    while (not wlan.isconnected() and
+           time.ticks_diff(time.ticks_ms(), start) < timeout_ms):
+        status = wlan.status()
+        if status in FAILED_STATUSES:
+            print("Wi-Fi connect failed, status", status)
+            return False
+        time.sleep_ms(SLEEP_STEP_MS)
+    return wlan.isconnected()
 
 
 def connect_wifi():
@@ -15,11 +82,26 @@ def connect_wifi():
 
     if not wlan.isconnected():
         print("Connecting to Wi-Fi...")
-        wlan.connect(WIFI_SSID, WIFI_PW)
-        start = time.ticks_ms()
-        while (not wlan.isconnected() and
-               time.ticks_diff(time.ticks_ms(), start) < CONNECT_TIMEOUT_MS):
-            time.sleep_ms(SLEEP_STEP_MS)
+        bssid = load_cached_bssid()
+        if bssid is not None:
+            # Target the access point that worked last time, skipping our own
+            # scan. Without a channel the driver still sweeps for it. This
+            # sticks to that access point while it answers, even if a stronger
+            # one has appeared; delete WIFI_CACHE_FILE to choose again.
+            wlan.connect(WIFI_SSID, WIFI_PW, bssid=bssid)
+            if not wait_connected(wlan, CACHED_CONNECT_TIMEOUT_MS):
+                print("Cached access point not reachable, rescanning")
+                wlan.disconnect()
+                forget_cached_bssid()
+
+        if not wlan.isconnected():
+            bssid = strongest_bssid(wlan)
+            if bssid is None:
+                wlan.connect(WIFI_SSID, WIFI_PW)
+            else:
+                wlan.connect(WIFI_SSID, WIFI_PW, bssid=bssid)
+            if wait_connected(wlan, CONNECT_TIMEOUT_MS) and bssid is not None:
+                save_cached_bssid(bssid)
 
     if wlan.isconnected():
         ip_address = wlan.ifconfig()[0]
@@ -2,11 +2,16 @@ import utime
 import machine
 import neopixel
 import random
+import array
 import micropython
+from micropython import const
 import uasyncio as asyncio
 import gc
 import json
 
+# Reserve room for tracebacks raised inside the (hard) motion IRQ.
+micropython.alloc_emergency_exception_buf(128)
+
 try:
     from umqtt.robust import MQTTClient as RobustMQTTClient
 except ImportError:
@@ -28,8 +33,10 @@ else:
     MQTT_CLIENT_IMPL = None
 
 ENABLE_WEBREPL = True
-ENABLE_MEMORY_DEBUG = True
-_MEMORY_LOG_INTERVAL_MS = 2000
+# A const so the compiler drops the "if ENABLE_MEMORY_DEBUG:" guarded calls,
+# tag formatting included, when it is 0.
+ENABLE_MEMORY_DEBUG = const(1)
+_MEMORY_LOG_INTERVAL_MS = const(2000)
 _last_memory_log = utime.ticks_add(utime.ticks_ms(), -_MEMORY_LOG_INTERVAL_MS)
 
 # ----------------------------
@@ -86,11 +93,22 @@ def mark_state_changed():
     _last_state_change = utime.time()
     _pending_save = True
 
+
+# Bumped whenever something shown on the index page changes, so the cached
+# page is only re-rendered when needed.
+_state_version = 0
+
+
+def touch_state_version():
+    global _state_version
+    _state_version += 1
+
 # ----------------------------
 # Hardware pins / strip config
 # ----------------------------
 LED_PIN = 18             # Strip data pin
-LED_COUNT = 182
+LED_COUNT = const(182)
+LAST_LED = const(LED_COUNT - 1)
 MOTION_SENSOR_PIN = 8    # PIR OUT connected here
 
 # Onboard NeoPixel (QT Py ESP32-S3)
@@ -113,12 +131,20 @@ MQTT_TOPIC_STATE_ON = b"tron/state/on"
 MQTT_TOPIC_STATE_BRIGHTNESS = b"tron/state/brightness"
 MQTT_TOPIC_STATE_COLORTEMP = b"tron/state/colortemp"
 MQTT_TOPIC_STATE_FIRE       = b"tron/state/fire"
+MQTT_TOPIC_STATE = b"tron/state"
+
+# Publish the strip state as one retained JSON message on MQTT_TOPIC_STATE
+# instead of the three tron/state/* topics.
+MQTT_STATE_JSON = False
+# Retain the brightness/colortemp (or combined JSON) state messages so new
+# subscribers see them at once. tron/state/on is always retained.
+MQTT_STATE_RETAIN = True
 
 MQTT_RECONNECT_DELAY_S = 5
 MQTT_KEEPALIVE = 60
 
-COLORTEMP_MIN = 140
-COLORTEMP_MAX = 500
+COLORTEMP_MIN = const(140)
+COLORTEMP_MAX = const(500)
 
 # ----------------------------
 # Shared state
@@ -165,6 +191,7 @@ _mqtt_last_state = {
     "on": None,
     "brightness": None,
     "colortemp": None,
+    "state": None,
 }
 
 _mqtt_last_activity = 0
@@ -179,33 +206,114 @@ def _reset_mqtt_state_cache():
     for key in _mqtt_last_state:
         _mqtt_last_state[key] = None
 
+
+# Encoded state payloads, filled on first use. Callers pass clamped values
+# (0-100 percent, COLORTEMP_MIN-COLORTEMP_MAX mireds), so brightness holds at
+# most 101 entries and colortemp 361. The cap only guards against a caller
+# that forgets to clamp.
+_PAYLOAD_CACHE_MAX = const(512)
+_brightness_payloads = {}
+_colortemp_payloads = {}
+
+
+def _encoded_int(cache, value):
+    payload = cache.get(value)
+    if payload is None:
+        if len(cache) >= _PAYLOAD_CACHE_MAX:
+            cache.clear()
+        payload = cache[value] = str(value).encode()
+    return payload
+
 # ----------------------------
 # Initialize hardware (order matters)
 # ----------------------------
+# On ESP32 ports NeoPixel.write() hands np.buf to machine.bitstream, which
+# already drives the RMT peripheral; only building np.buf costs CPU time.
 np = neopixel.NeoPixel(machine.Pin(LED_PIN), LED_COUNT)
 motion_sensor = machine.Pin(MOTION_SENSOR_PIN, machine.Pin.IN, machine.Pin.PULL_DOWN)
 neo_pwr = machine.Pin(NEO_PWR_EN_PIN, machine.Pin.OUT)
 neo_pwr.value(1)
 neo_ind = neopixel.NeoPixel(machine.Pin(NEO_DATA_PIN), 1)
 
+# Byte offset within np.buf of each (warm, cool, blue) channel.
+_PIXEL_ORDER = np.ORDER
+
+
+_BLACK = (0, 0, 0)
+_INDICATOR_ON = (0, 128, 0)
+_INDICATOR_OFF = _BLACK
+_indicator_color = None
+
 
 def set_indicator(is_high: int):
-    neo_ind[0] = (0, 128, 0) if is_high else (0, 0, 0)
+    global _indicator_color
+    color = _INDICATOR_ON if is_high else _INDICATOR_OFF
+    if color is _indicator_color:
+        return  # PIR bounce repeated the level; the LED already shows it
+    _indicator_color = color
+    neo_ind[0] = color
     neo_ind.write()
 
 
 set_indicator(motion_sensor.value())
 
-micropython.alloc_emergency_exception_buf(100)
-
 # ----------------------------
 # Animation helpers
 # ----------------------------
 _anim_busy = False
 _fire_sequence = None
-_motion_flag = False
-_pending_motion = None
-_active_bursts = []
+# Set from the PIR hard IRQ on each rising edge; motion_poller sleeps on it.
+_motion_event = asyncio.ThreadSafeFlag()
+_pending_motion = None  # ticks_ms deadline of a delayed motion fire
+# Set by request_fire so an idle animation_consumer wakes immediately.
+_fire_event = asyncio.Event()
+
+# Active bursts live in parallel arrays indexed by slot; slots
+# [0, _burst_count) are in use. A fire is refused while bursts are active, so
+# at most MAX_BURSTS_PER_FIRE exist at once. Each slot's trail colour buffer
+# is preallocated at the largest possible trail (every LED).
+MAX_BURSTS_PER_FIRE = const(3)
+_burst_count = 0
+_burst_pos = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_dir = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_end = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_trail = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_delay = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_next = array.array("i", [0] * MAX_BURSTS_PER_FIRE)  # ticks_ms of next step
+_burst_bounce = array.array("i", [0] * MAX_BURSTS_PER_FIRE)
+_burst_colors = [bytearray(LED_COUNT * 3) for _ in range(MAX_BURSTS_PER_FIRE)]
+# Earliest _burst_next entry, kept up to date as bursts start and step so the
+# scheduler does not rescan every slot. Only meaningful while _burst_count > 0.
+_next_burst_due = 0
+
+# The strip buffer holds _painted_color everywhere except LEDs in
+# [_painted_lo, _painted_hi), which the last burst frame drew over.
+# _base_pattern keeps a whole strip of _painted_color to restore them from.
+_painted_color = None
+_painted_lo = LED_COUNT
+_painted_hi = 0
+_base_pattern = bytearray(LED_COUNT * 3)
+_base_view = memoryview(_base_pattern)
+_np_view = memoryview(np.buf)
+
+
+@micropython.viper
+def _repeat_first_pixel(buf: ptr8, length: int):
+    # Copy the 3 bytes at the start of buf over the rest of its `length` bytes.
+    for i in range(3, length):
+        buf[i] = buf[i - 3]
+
+
+def _fill_base(color):
+    global _painted_color, _painted_lo, _painted_hi
+    pattern = _base_pattern
+    for channel in range(3):
+        pattern[_PIXEL_ORDER[channel]] = color[channel]
+    _repeat_first_pixel(pattern, LED_COUNT * 3)
+    np.buf[:] = pattern
+    _painted_color = color
+    _painted_lo = LED_COUNT
+    _painted_hi = 0
 
 
 def _coerce_float(value, fallback=0.0):
@@ -221,27 +329,21 @@ def _coerce_float(value, fallback=0.0):
 
 
 def _resolve_burst_gap_range(params):
+    # Rounded to whole ms once per fire, so sampling each gap is integer-only.
     fallback = params.get("BURST_GAP_MS", 0.0)
     gap_min = _coerce_float(params.get("BURST_GAP_MIN_MS"), fallback)
     gap_max = _coerce_float(params.get("BURST_GAP_MAX_MS"), fallback)
-    if gap_min < 0:
-        gap_min = 0.0
-    if gap_max < 0:
-        gap_max = 0.0
+    gap_min = int(gap_min + 0.5) if gap_min > 0 else 0
+    gap_max = int(gap_max + 0.5) if gap_max > 0 else 0
     if gap_max < gap_min:
         gap_min, gap_max = gap_max, gap_min
     return gap_min, gap_max
 
 
 def _sample_burst_gap_ms_from_range(gap_min, gap_max):
-    if gap_max <= 0:
-        return 0
     if gap_max <= gap_min:
-        return int(gap_min)
-    gap = random.uniform(gap_min, gap_max)
-    if gap <= 0:
-        return 0
-    return int(gap + 0.5)
+        return gap_min
+    return random.randint(gap_min, gap_max)
 
 
 def request_fire(source: str):
@@ -250,7 +352,7 @@ def request_fire(source: str):
     if _pending_motion is not None and source != "motion":
         print("Fire ignored (%s); motion delay active" % source)
         return False
-    if _anim_busy or _active_bursts:
+    if _anim_busy or _burst_count:
         print("Fire ignored (%s); animation busy" % source)
         return False
     if _fire_sequence is not None:
@@ -259,10 +361,12 @@ def request_fire(source: str):
 
     if "BURST_GAP_MIN_MS" not in params and "BURST_GAP_MS" in params:
         params["BURST_GAP_MIN_MS"] = _coerce_float(params["BURST_GAP_MS"], 0.0)
+        touch_state_version()
     if "BURST_GAP_MAX_MS" not in params and "BURST_GAP_MS" in params:
         params["BURST_GAP_MAX_MS"] = _coerce_float(params["BURST_GAP_MS"], 0.0)
+        touch_state_version()
 
-    burst_total = random.randint(1, 3)
+    burst_total = random.randint(1, MAX_BURSTS_PER_FIRE)
     gap_min, gap_max = _resolve_burst_gap_range(params)
     now_ms = utime.ticks_ms()
     _fire_sequence = {
@@ -273,10 +377,12 @@ def request_fire(source: str):
         "gap_max": gap_max,
         "next_fire_at": now_ms,
     }
+    _fire_event.set()
     print("Fire accepted (%s); scheduling %d burst(s)" % (source, burst_total))
     return True
 
 
+@micropython.native
 def clamp(value, lower, upper):
     if value < lower:
         return lower
@@ -285,10 +391,11 @@ def clamp(value, lower, upper):
     return value
 
 
+@micropython.native
 def colortemp_to_levels(colortemp):
     try:
         value = int(colortemp)
-    except (TypeError, ValueError):
+    except (TypeError, ValueError, OverflowError):
         value = COLORTEMP_MAX
     if value < COLORTEMP_MIN:
         value = COLORTEMP_MIN
@@ -297,12 +404,11 @@ def colortemp_to_levels(colortemp):
     span = COLORTEMP_MAX - COLORTEMP_MIN
     if span <= 0:
         return 255, 0
-    warm_ratio = value - COLORTEMP_MIN
-    warm_level = int((warm_ratio * 255 + span // 2) // span)
-    cool_level = 255 - warm_level
-    return warm_level, cool_level
+    warm_level = ((value - COLORTEMP_MIN) * 255 + span // 2) // span
+    return warm_level, 255 - warm_level
 
 
+@micropython.native
 def brightness_to_percent(brightness):
     percent = int(brightness * 100 + 0.5)
     if percent < 0:
@@ -312,21 +418,32 @@ def brightness_to_percent(brightness):
     return percent
 
 
-def set_cct_color(warm_level, cool_level):
-    warm = max(0, min(255, int(warm_level)))
-    cool = max(0, min(255, int(cool_level)))
-    return (warm, cool, 0)
-
-
 def get_strip_base_color():
     if not state["strip_on"]:
-        return (0, 0, 0)
+        return _BLACK
 
     brightness = clamp(state["strip_brightness"], 0.0, 1.0)
     warm_level, cool_level = colortemp_to_levels(state["strip_colortemp"])
-    warm_value = warm_level * brightness
-    cool_value = cool_level * brightness
-    return set_cct_color(warm_value, cool_value)
+    # Both levels are 0..255 and brightness is clamped to 0..1, so the
+    # products are already valid channel values.
+    return (int(warm_level * brightness), int(cool_level * brightness), 0)
+
+
+# Cached get_strip_base_color() result; None once the strip settings change.
+_base_color = None
+
+
+def _invalidate_base_color():
+    global _base_color
+    _base_color = None
+
+
+def _current_base_color():
+    global _base_color
+    color = _base_color
+    if color is None:
+        color = _base_color = get_strip_base_color()
+    return color
 
 
 def apply_steady_state(force: bool = False):
@@ -334,227 +451,431 @@ def apply_steady_state(force: bool = False):
     if _anim_busy and not force:
         return
 
-    color = get_strip_base_color()
-    np.fill(color)
+    color = _current_base_color()
+    if not force and color == _painted_color and _painted_lo >= _painted_hi:
+        # The strip already shows exactly this frame; skip the rewrite.
+        return
+    _fill_base(color)
     np.write()
 
 
+def _publish_state_value(client, key, topic, payload, force, retain=True):
+    if not force and _mqtt_last_state[key] == payload:
+        return True
+    try:
+        client.publish(topic, payload, retain=retain)
+        _mqtt_last_state[key] = payload
+        _touch_mqtt_activity()
+    except Exception as exc:
+        print("MQTT publish failed:", exc)
+        _reset_mqtt_state_cache()
+        return False
+    return True
+
+
 def publish_mqtt_state(force=False):
     client = _mqtt_client
     if client is None:
         return
 
+    if MQTT_STATE_JSON:
+        payload = '{"on":%d,"brightness":%d,"colortemp":%d}' % (
+            1 if state["strip_on"] else 0,
+            brightness_to_percent(state["strip_brightness"]),
+            int(clamp(state["strip_colortemp"], COLORTEMP_MIN, COLORTEMP_MAX)),
+        )
+        _publish_state_value(
+            client, "state", MQTT_TOPIC_STATE, payload.encode(), force, MQTT_STATE_RETAIN
+        )
+        return
+
     on_payload = b"1" if state["strip_on"] else b"0"
+    if not _publish_state_value(client, "on", MQTT_TOPIC_STATE_ON, on_payload, force):
+        return
     brightness_pct = brightness_to_percent(state["strip_brightness"])
+    brightness_payload = _encoded_int(_brightness_payloads, brightness_pct)
+    if not _publish_state_value(
+        client, "brightness", MQTT_TOPIC_STATE_BRIGHTNESS, brightness_payload, force,
+        MQTT_STATE_RETAIN,
+    ):
+        return
     colortemp_value = int(clamp(state["strip_colortemp"], COLORTEMP_MIN, COLORTEMP_MAX))
-    payloads = {
-        "on": on_payload,
-        "brightness": str(brightness_pct).encode(),
-        "colortemp": str(colortemp_value).encode(),
-    }
-    topics = {
-        "on": MQTT_TOPIC_STATE_ON,
-        "brightness": MQTT_TOPIC_STATE_BRIGHTNESS,
-        "colortemp": MQTT_TOPIC_STATE_COLORTEMP,
-    }
-
-    for key in payloads:
-        if not force and _mqtt_last_state[key] == payloads[key]:
-            continue
-        try:
-            client.publish(topics[key], payloads[key], retain=True)
-            _mqtt_last_state[key] = payloads[key]
-            _touch_mqtt_activity()
-        except Exception as exc:
-            print("MQTT publish failed:", exc)
-            _reset_mqtt_state_cache()
-            break
+    colortemp_payload = _encoded_int(_colortemp_payloads, colortemp_value)
+    _publish_state_value(
+        client, "colortemp", MQTT_TOPIC_STATE_COLORTEMP, colortemp_payload, force,
+        MQTT_STATE_RETAIN,
+    )
 
 
-def _create_burst_state(params):
-    num_leds = LED_COUNT
-    brightness_factor = params.get("BRIGHTNESS_FACTOR", 0.25)
-    warm_level = params.get("WARM_LEVEL", 255)
-    cool_level = params.get("COOL_LEVEL", 0)
-    delay_min_ms = params.get("DELAY_MIN", 5.0)
-    delay_max_ms = params.get("DELAY_MAX", 10.0)
-    trail_min = params.get("TRAIL_MIN", 1)
-    trail_max = params.get("TRAIL_MAX", 3)
-    min_endpoint = int(params.get("MIN_ENDPOINT", num_leds - 1))
-    max_endpoint = int(params.get("MAX_ENDPOINT", num_leds - 1))
-    bounce = bool(params.get("BOUNCE", False))
+# Set whenever the strip settings change. state_publisher_task waits briefly
+# and then publishes once, so several updates arriving together (one HTTP
+# form, a slider drag) share one set of MQTT PUBLISHes. Only tasks set it,
+# so a plain Event does; ThreadSafeFlag is kept for IRQ sources.
+_state_publish = asyncio.Event()
+request_state_publish = _state_publish.set
 
-    try:
-        brightness_factor = float(brightness_factor)
-    except (TypeError, ValueError):
-        brightness_factor = 0.25
-    brightness_factor = clamp(brightness_factor, 0.0, 1.0)
 
-    try:
-        warm_level = int(warm_level)
-    except (TypeError, ValueError):
-        warm_level = 255
-    try:
-        cool_level = int(cool_level)
-    except (TypeError, ValueError):
-        cool_level = 0
-    if warm_level < 0:
-        warm_level = 0
-    if cool_level < 0:
-        cool_level = 0
-
-    delay_min_ms = max(0.0, float(delay_min_ms))
-    delay_max_ms = max(delay_min_ms, float(delay_max_ms))
-    trail_min = max(1, int(trail_min))
-    trail_max = max(trail_min, int(trail_max))
-    min_endpoint = max(0, min(num_leds - 1, int(min_endpoint)))
-    max_endpoint = max(min_endpoint, min(num_leds - 1, int(max_endpoint)))
-
-    speed_ms = max(1.0, random.uniform(delay_min_ms, delay_max_ms))
-    delay_ms = max(1, int(round(speed_ms)))
-    trail = random.randint(trail_min, trail_max)
-    endpoint = random.randint(min_endpoint, max_endpoint)
-    trail = max(1, min(trail, endpoint + 1))
+async def state_publisher_task():
+    while True:
+        await _state_publish.wait()
+        await asyncio.sleep_ms(20)
+        _state_publish.clear()
+        try:
+            publish_mqtt_state()
+        except Exception as exc:
+            print("State publish error:", exc)
+            log_memory("state publish error", force=True, collect=True)
+
+
+class _BurstParams:
+    # Validated burst settings derived from state["params"]. Rebuilt only when
+    # touch_state_version() reports a change, so starting a burst skips the
+    # lookups, casts and clamps.
+
+    def __init__(self, params):
+        get = params.get
+        brightness_factor = get("BRIGHTNESS_FACTOR", 0.25)
+        warm_level = get("WARM_LEVEL", 255)
+        cool_level = get("COOL_LEVEL", 0)
+        delay_min_ms = get("DELAY_MIN", 5.0)
+        delay_max_ms = get("DELAY_MAX", 10.0)
+        trail_min = get("TRAIL_MIN", 1)
+        trail_max = get("TRAIL_MAX", 3)
+        min_endpoint = get("MIN_ENDPOINT", LAST_LED)
+        max_endpoint = get("MAX_ENDPOINT", LAST_LED)
 
-    now_ms = utime.ticks_ms()
+        try:
+            brightness_factor = float(brightness_factor)
+        except (TypeError, ValueError):
+            brightness_factor = 0.25
+        brightness_factor = clamp(brightness_factor, 0.0, 1.0)
 
-    return {
-        "position": 0,
-        "direction": 1,
-        "endpoint": endpoint,
-        "trail": trail,
-        "speed_ms": speed_ms,
-        "delay_ms": delay_ms,
-        "next_step_at": utime.ticks_add(now_ms, delay_ms),
-        "bounce": bounce and endpoint > 0,
-        "brightness_factor": brightness_factor,
-        "warm_level": warm_level,
-        "cool_level": cool_level,
-    }
+        try:
+            warm_level = int(warm_level)
+        except (TypeError, ValueError):
+            warm_level = 255
+        try:
+            cool_level = int(cool_level)
+        except (TypeError, ValueError):
+            cool_level = 0
+        if warm_level < 0:
+            warm_level = 0
+        if cool_level < 0:
+            cool_level = 0
+
+        delay_min_ms = max(0.0, float(delay_min_ms))
+        delay_max_ms = max(delay_min_ms, float(delay_max_ms))
+        trail_min = max(1, int(trail_min))
+        min_endpoint = max(0, min(LAST_LED, int(min_endpoint)))
+
+        self.scale_q16 = int(brightness_factor * 65536)
+        self.warm_level = warm_level
+        self.cool_level = cool_level
+        self.delay_min = int(delay_min_ms + 0.5)
+        self.delay_max = int(delay_max_ms + 0.5)
+        self.trail_min = trail_min
+        self.trail_max = max(trail_min, int(trail_max))
+        self.min_endpoint = min_endpoint
+        self.max_endpoint = max(min_endpoint, min(LAST_LED, int(max_endpoint)))
+        self.bounce = bool(get("BOUNCE", False))
+
+
+_burst_params = None
+_burst_params_version = -1
+
+
+def _current_burst_params():
+    global _burst_params, _burst_params_version
+    if _burst_params is None or _burst_params_version != _state_version:
+        _burst_params = _BurstParams(state["params"])
+        _burst_params_version = _state_version
+    return _burst_params
+
+
+def _start_burst():
+    # Fill the next free burst slot from the current params. Returns False if
+    # every slot is already in use.
+    global _burst_count, _next_burst_due
+    slot = _burst_count
+    if slot >= MAX_BURSTS_PER_FIRE:
+        return False
+    bp = _current_burst_params()
+    trail_min = bp.trail_min
+    trail_max = bp.trail_max
+    warm_level = bp.warm_level
+    cool_level = bp.cool_level
+
+    randint = random.randint
+    delay_ms = randint(bp.delay_min, bp.delay_max)
+    if delay_ms < 1:
+        delay_ms = 1
+    endpoint = randint(bp.min_endpoint, bp.max_endpoint)
+    # The trail can never be longer than the run up to the endpoint, so cap
+    # the range before sampling instead of clamping the result.
+    if trail_max > endpoint + 1:
+        trail_max = endpoint + 1
+        if trail_min > trail_max:
+            trail_min = trail_max
+    trail = randint(trail_min, trail_max)
+
+    # Trail colours only depend on per-burst constants, so build them once here
+    # (as raw strip bytes) instead of redoing the float math for every LED on
+    # every frame. Only the leading trail * 3 bytes are used; the blue bytes
+    # are never written, so they stay zero across reuse.
+    trail_colors = _burst_colors[slot]
+    scale_q16 = bp.scale_q16
+    warm_offset = _PIXEL_ORDER[0]
+    cool_offset = _PIXEL_ORDER[1]
+    for i in range(trail):
+        level_q16 = (trail - i) * scale_q16 // trail
+        offset = i * 3
+        trail_colors[offset + warm_offset] = min(255, (warm_level * level_q16) >> 16)
+        trail_colors[offset + cool_offset] = min(255, (cool_level * level_q16) >> 16)
+
+    _burst_pos[slot] = 0
+    _burst_dir[slot] = 1
+    _burst_end[slot] = endpoint
+    _burst_trail[slot] = trail
+    _burst_delay[slot] = delay_ms
+    next_at = utime.ticks_add(utime.ticks_ms(), delay_ms)
+    _burst_next[slot] = next_at
+    if slot == 0 or utime.ticks_diff(next_at, _next_burst_due) < 0:
+        _next_burst_due = next_at
+    _burst_bounce[slot] = 1 if bp.bounce and endpoint > 0 else 0
+    _burst_count = slot + 1
+    return True
 
 
-def _render_active_bursts(bursts):
-    if not bursts:
+@micropython.viper
+def _blend_trail(buf: ptr8, trail_colors: ptr8, position: int, count: int):
+    # Max-blend `count` trail LEDs ending at `position` into the strip buffer.
+    # trail_colors holds 3 bytes per trail offset, already in strip byte order.
+    # _step_burst retires a burst before it passes its endpoint, so every
+    # LED drawn here is within range.
+    src = 0
+    dst = position * 3
+    for i in range(count):
+        value = trail_colors[src]
+        if value > buf[dst]:
+            buf[dst] = value
+        value = trail_colors[src + 1]
+        if value > buf[dst + 1]:
+            buf[dst + 1] = value
+        value = trail_colors[src + 2]
+        if value > buf[dst + 2]:
+            buf[dst + 2] = value
+        src += 3
+        dst -= 3
+
+
+def _render_active_bursts():
+    global _painted_lo, _painted_hi
+    count = _burst_count
+    if not count:
         return
-    base_color = get_strip_base_color()
-    np.fill(base_color)
-    for burst in bursts:
-        brightness_factor = burst["brightness_factor"]
-        warm_level = burst["warm_level"]
-        cool_level = burst["cool_level"]
-        trail = burst["trail"]
-        endpoint = burst["endpoint"]
-        position = burst["position"]
-        for i in range(trail):
-            led_pos = position - i
-            if led_pos < 0:
-                break
-            if led_pos > endpoint:
-                continue
-            brightness = ((trail - i) / trail) * brightness_factor
-            warm_value = warm_level * brightness
-            cool_value = cool_level * brightness
-            warm, cool, blue = set_cct_color(warm_value, cool_value)
-            current = np[led_pos]
-            np[led_pos] = (
-                max(current[0], warm),
-                max(current[1], cool),
-                max(current[2], blue),
-            )
-    np.write()
-
-
-def _step_burst(burst):
-    burst["position"] += burst["direction"]
-    if burst["bounce"]:
-        if burst["direction"] > 0 and burst["position"] >= burst["endpoint"]:
-            burst["position"] = max(0, burst["endpoint"] - 1)
-            burst["direction"] = -1
-        elif burst["direction"] < 0 and burst["position"] <= 0:
-            burst["position"] = 0
-            return False
-    else:
-        if burst["position"] > burst["endpoint"]:
+    pixels = np
+    buf = pixels.buf
+    blend = _blend_trail
+    positions = _burst_pos
+    trails = _burst_trail
+    colors = _burst_colors
+    base_color = _current_base_color()
+    if base_color != _painted_color:
+        _fill_base(base_color)
+    elif _painted_lo < _painted_hi:
+        # Only the LEDs drawn by the previous frame differ from the base;
+        # copy them back from the base pattern in one slice assignment.
+        lo = _painted_lo * 3
+        hi = _painted_hi * 3
+        _np_view[lo:hi] = _base_view[lo:hi]
+    painted_lo = LED_COUNT
+    painted_hi = 0
+    for slot in range(count):
+        position = positions[slot]
+        tail = position - trails[slot] + 1
+        if tail < 0:
+            tail = 0
+        if tail < painted_lo:
+            painted_lo = tail
+        if position >= painted_hi:
+            painted_hi = position + 1
+        blend(buf, colors[slot], position, position - tail + 1)
+    _painted_lo = painted_lo
+    _painted_hi = painted_hi
+    pixels.write()
+
+
+@micropython.native
+def _step_burst(slot):
+    position = _burst_pos[slot] + _burst_dir[slot]
+    endpoint = _burst_end[slot]
+    if _burst_bounce[slot]:
+        if _burst_dir[slot] > 0:
+            if position >= endpoint:
+                position = endpoint - 1  # bounce is only set when endpoint > 0
+                _burst_dir[slot] = -1
+        elif position <= 0:
             return False
+    elif position > endpoint:
+        return False
+    _burst_pos[slot] = position
     return True
 
 
+def _retire_burst(slot):
+    # Move the last live burst into the freed slot. The blend is a per-channel
+    # max, so draw order does not matter.
+    global _burst_count
+    last = _burst_count - 1
+    if slot != last:
+        _burst_pos[slot] = _burst_pos[last]
+        _burst_dir[slot] = _burst_dir[last]
+        _burst_end[slot] = _burst_end[last]
+        _burst_trail[slot] = _burst_trail[last]
+        _burst_delay[slot] = _burst_delay[last]
+        _burst_next[slot] = _burst_next[last]
+        _burst_bounce[slot] = _burst_bounce[last]
+        colors = _burst_colors
+        colors[slot], colors[last] = colors[last], colors[slot]
+    _burst_count = last
+
+
+@micropython.native
 def _advance_due_bursts(now_ms):
+    # Steps every due burst and refreshes _next_burst_due from the survivors
+    # (retiring compacts the slots, so the first survivor is always slot 0).
+    global _next_burst_due
+    ticks_diff = utime.ticks_diff
+    ticks_add = utime.ticks_add
+    next_at = _burst_next
     changed = False
-    remaining = []
-    for burst in _active_bursts:
+    due = _next_burst_due
+    slot = 0
+    while slot < _burst_count:
         active = True
-        while utime.ticks_diff(now_ms, burst["next_step_at"]) >= 0:
-            if not _step_burst(burst):
+        while ticks_diff(now_ms, next_at[slot]) >= 0:
+            changed = True
+            if not _step_burst(slot):
                 active = False
-                changed = True
                 break
-            burst["next_step_at"] = utime.ticks_add(burst["next_step_at"], burst["delay_ms"])
-            changed = True
+            next_at[slot] = ticks_add(next_at[slot], _burst_delay[slot])
         if active:
-            remaining.append(burst)
-    _active_bursts[:] = remaining
+            if slot == 0 or ticks_diff(next_at[slot], due) < 0:
+                due = next_at[slot]
+            slot += 1
+        else:
+            _retire_burst(slot)
+    _next_burst_due = due
     return changed
 
 
+_schedule = micropython.schedule
+# Bound once so the IRQ does not allocate a bound method on every edge.
+_signal_motion = _motion_event.set
+
+
 def motion_irq(pin):
-    global _motion_flag
-    if not _motion_flag:
-        _motion_flag = True
+    # Runs as a hard IRQ on both edges: must not allocate. The indicator
+    # write cannot run here, so it is deferred to the scheduler.
+    level = pin.value()
+    try:
+        _schedule(set_indicator, level)
+    except RuntimeError:
+        pass  # schedule queue full; the next edge resyncs the indicator
+    if level:
+        _signal_motion()
 
 
-motion_sensor.irq(trigger=machine.Pin.IRQ_RISING, handler=motion_irq)
+motion_sensor.irq(
+    trigger=machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING,
+    handler=motion_irq,
+    hard=True,
+)
 
 
 async def animation_consumer():
     global _anim_busy, _fire_sequence
+    ticks_ms = utime.ticks_ms
+    ticks_diff = utime.ticks_diff
+    ticks_add = utime.ticks_add
+    sleep_ms = asyncio.sleep_ms
     while True:
         processed = False
         seq = _fire_sequence
         if seq is not None:
-            now_ms = utime.ticks_ms()
-            if utime.ticks_diff(now_ms, seq["next_fire_at"]) >= 0:
+            now_ms = ticks_ms()
+            # Launch every burst that is due; zero-gap bursts start together
+            # instead of each waiting for another pass through the loop.
+            while seq is not None and ticks_diff(now_ms, seq["next_fire_at"]) >= 0:
                 seq_source = seq.get("source", "?")
                 seq_total = seq.get("total", 1)
                 seq["remaining"] -= 1
-                burst = _create_burst_state(state["params"])
-                _active_bursts.append(burst)
+                if not _start_burst():
+                    print("Burst skipped; no free burst slot")
                 _anim_busy = True
                 processed = True
                 fired_index = seq_total - seq["remaining"]
                 print("Running Tron burst (source: %s #%d/%d)" % (seq_source, fired_index, seq_total))
-                log_memory("anim burst start (%s #%d)" % (seq_source, fired_index), force=True)
+                if ENABLE_MEMORY_DEBUG:
+                    log_memory("anim burst start (%s #%d)" % (seq_source, fired_index), force=True)
                 if seq["remaining"] > 0:
                     gap_ms = _sample_burst_gap_ms_from_range(seq["gap_min"], seq["gap_max"])
-                    seq["next_fire_at"] = utime.ticks_add(now_ms, gap_ms)
+                    seq["next_fire_at"] = ticks_add(now_ms, gap_ms)
                 else:
                     _fire_sequence = None
+                    seq = None
         if processed:
-            _render_active_bursts(_active_bursts)
+            _render_active_bursts()
 
-        if not _active_bursts:
-            await asyncio.sleep_ms(5)
+        if not _burst_count:
+            if _fire_sequence is None:
+                # Nothing to draw or launch: sleep until request_fire.
+                _fire_event.clear()
+                await _fire_event.wait()
+            else:
+                wait_ms = ticks_diff(_fire_sequence["next_fire_at"], ticks_ms())
+                if wait_ms > 0:
+                    await sleep_ms(wait_ms)
             continue
 
-        now_ms = utime.ticks_ms()
-        next_deadline = min(burst["next_step_at"] for burst in _active_bursts)
-        wait_ms = utime.ticks_diff(next_deadline, now_ms)
+        now_ms = ticks_ms()
+        wait_ms = ticks_diff(_next_burst_due, now_ms)
         if wait_ms > 0:
-            await asyncio.sleep_ms(wait_ms)
-            now_ms = utime.ticks_ms()
+            await sleep_ms(wait_ms)
+            now_ms = ticks_ms()
 
         if _advance_due_bursts(now_ms):
-            if _active_bursts:
-                _render_active_bursts(_active_bursts)
+            if _burst_count:
+                _render_active_bursts()
             else:
                 _anim_busy = False
                 apply_steady_state(force=True)
 
 
+# Set by settings changes; steady_update_task applies them once per wake, so a
+# burst of MQTT/HTTP updates costs a single strip write.
+_steady_update = asyncio.Event()
+request_steady_state = _steady_update.set
+
+
+async def steady_update_task():
+    while True:
+        await _steady_update.wait()
+        _steady_update.clear()
+        try:
+            apply_steady_state()
+        except Exception as exc:
+            print("Steady update error:", exc)
+            log_memory("steady update error", force=True, collect=True)
+
+
 async def steady_refresh_task():
     while True:
         await asyncio.sleep(10)
-        apply_steady_state()
+        if not _anim_busy:
+            # Resend the idle frame even if unchanged, in case the strip
+            # dropped it.
+            apply_steady_state(force=True)
 
 
 async def memory_monitor():
@@ -576,133 +897,179 @@ async def state_saver_task():
 
 
 async def motion_poller():
-    global _motion_flag, _pending_motion, _anim_busy
-    last_level = motion_sensor.value()
-    print("PIR initial level:", "HIGH" if last_level else "LOW")
+    global _pending_motion
+    print("PIR initial level:", "HIGH" if motion_sensor.value() else "LOW")
 
     while True:
-        cur = motion_sensor.value()
-        if cur != last_level:
-            last_level = cur
-            set_indicator(cur)
-
-        if _motion_flag:
-            _motion_flag = False
-            if _pending_motion is None:
-                if _anim_busy or _active_bursts:
-                    print("Motion ignored; animation busy")
-                elif _fire_sequence is not None:
-                    print("Motion ignored; fire already pending")
-                else:
-                    params = state["params"]
-                    min_wait = max(0.0, float(params["MIN_MOTION_WAIT"]))
-                    max_wait = max(min_wait, float(params["MAX_MOTION_WAIT"]))
-                    wait_time = random.uniform(min_wait, max_wait)
-                    fire_at = utime.ticks_add(utime.ticks_ms(), int(wait_time * 1000))
-                    _pending_motion = {
-                        "fire_at": fire_at,
-                        "printed": False,
-                        "wait_time": wait_time,
-                    }
-            else:
-                print("Motion ignored; delay already pending")
+        await _motion_event.wait()
+        if _anim_busy or _burst_count:
+            print("Motion ignored; animation busy")
+            continue
+        if _fire_sequence is not None:
+            print("Motion ignored; fire already pending")
+            continue
 
-        pending = _pending_motion
-        if pending is not None:
-            if not pending["printed"]:
-                print("Motion detected! Waiting %.2f seconds before running tron burst sequence..." % pending["wait_time"])
-                pending["printed"] = True
+        params = state["params"]
+        min_wait = max(0.0, float(params["MIN_MOTION_WAIT"]))
+        max_wait = max(min_wait, float(params["MAX_MOTION_WAIT"]))
+        wait_ms = random.randint(int(min_wait * 1000), int(max_wait * 1000))
+        _pending_motion = utime.ticks_add(utime.ticks_ms(), wait_ms)
+        print("Motion detected! Waiting %d ms before running tron burst sequence..." % wait_ms)
+        # Sleep straight to the fire instant; edges during the delay only
+        # re-set the flag and are dropped below as busy.
+        await asyncio.sleep_ms(wait_ms)
+        _pending_motion = None
+        if not request_fire("motion"):
+            print("Motion fire dropped; conditions blocked trigger")
+
+
+def _apply_mqtt_strip_setting(key, value):
+    changed = state[key] != value
+    state[key] = value
+    if changed:
+        touch_state_version()
+        _invalidate_base_color()
+        request_steady_state()
+    request_state_publish()
+
+
+def _mqtt_cmd_on(payload):
+    if ENABLE_MEMORY_DEBUG:
+        log_memory("mqtt cmd on", force=True)
+    if payload in ("1", "0"):
+        desired = payload == "1"
+        print("MQTT: base on -> %s" % ("ON" if desired else "OFF"))
+        _apply_mqtt_strip_setting("strip_on", desired)
+    else:
+        print("MQTT: invalid on payload '%s'" % payload)
 
-            if utime.ticks_diff(utime.ticks_ms(), pending["fire_at"]) >= 0:
-                _pending_motion = None
-                if not request_fire("motion"):
-                    print("Motion fire dropped; conditions blocked trigger")
 
-        await asyncio.sleep_ms(100)
+def _mqtt_cmd_brightness(payload):
+    if ENABLE_MEMORY_DEBUG:
+        log_memory("mqtt cmd brightness", force=True)
+    try:
+        pct_value = float(payload)
+    except ValueError:
+        pct_value = None
+    if pct_value is None or pct_value != pct_value:  # unparseable or nan
+        print("MQTT: invalid brightness '%s'" % payload)
+        return
+    pct_value = clamp(pct_value, 0.0, 100.0)
+    pct_display = int(pct_value + 0.5)
+    print("MQTT: brightness -> %d%%" % pct_display)
+    _apply_mqtt_strip_setting("strip_brightness", pct_value / 100.0)
+
+
+def _mqtt_cmd_colortemp(payload):
+    if ENABLE_MEMORY_DEBUG:
+        log_memory("mqtt cmd colortemp", force=True)
+    try:
+        colortemp_value = int(float(payload))
+    except ValueError:
+        print("MQTT: invalid colortemp '%s'" % payload)
+        return
+    colortemp_value = int(clamp(colortemp_value, COLORTEMP_MIN, COLORTEMP_MAX))
+    print("MQTT: colortemp -> %d" % colortemp_value)
+    _apply_mqtt_strip_setting("strip_colortemp", colortemp_value)
+
+
+_fire_reset_event = asyncio.Event()
+
+
+async def _fire_reset_task():
+    # Long-lived so an MQTT fire does not allocate a fresh closure and task
+    # just to publish the momentary OFF.
+    while True:
+        await _fire_reset_event.wait()
+        _fire_reset_event.clear()
+        await asyncio.sleep_ms(200)
+        try:
+            if _mqtt_client:
+                _mqtt_client.publish(MQTT_TOPIC_STATE_FIRE, b"0", retain=True)
+        except Exception as exc:
+            print("MQTT fire reset failed:", exc)
+
+
+def _mqtt_cmd_fire(payload):
+    if ENABLE_MEMORY_DEBUG:
+        log_memory("mqtt cmd fire", force=True)
+    if payload != "1":
+        print("MQTT: fire ignored payload '%s'" % payload)
+        return
+    print("MQTT: fire command")
+    if not request_fire("mqtt"):
+        print("MQTT: fire ignored; busy or delayed")
+        return
+    # The controller already shows the switch ON from its own command; only
+    # the OFF is published, after a short delay, so the UI acts momentary.
+    _fire_reset_event.set()
+
+
+_MQTT_DISPATCH = {
+    MQTT_TOPIC_CMD_ON: _mqtt_cmd_on,
+    MQTT_TOPIC_CMD_BRIGHTNESS: _mqtt_cmd_brightness,
+    MQTT_TOPIC_CMD_COLORTEMP: _mqtt_cmd_colortemp,
+    MQTT_TOPIC_CMD_FIRE: _mqtt_cmd_fire,
+}
 
 
 def mqtt_message(topic, msg):
     _touch_mqtt_activity()
 
+    handler = _MQTT_DISPATCH.get(topic or b"")
+    if handler is None:
+        return
+
     try:
         payload = msg.decode().strip()
     except Exception:
         payload = str(msg)
 
-    topic = topic or b""
+    handler(payload)
 
-    if topic == MQTT_TOPIC_CMD_ON:
-        log_memory("mqtt cmd on", force=True)
-        if payload in ("1", "0"):
-            desired = payload == "1"
-            print("MQTT: base on -> %s" % ("ON" if desired else "OFF"))
-            changed = state["strip_on"] != desired
-            state["strip_on"] = desired
-            if changed:
-                apply_steady_state()
-            publish_mqtt_state(force=True)
-        else:
-            print("MQTT: invalid on payload '%s'" % payload)
-    elif topic == MQTT_TOPIC_CMD_BRIGHTNESS:
-        log_memory("mqtt cmd brightness", force=True)
-        try:
-            pct_value = float(payload)
-        except ValueError:
-            print("MQTT: invalid brightness '%s'" % payload)
-            return
-        pct_value = clamp(pct_value, 0.0, 100.0)
-        brightness = pct_value / 100.0
-        pct_display = int(pct_value + 0.5)
-        print("MQTT: brightness -> %d%%" % pct_display)
-        changed = state["strip_brightness"] != brightness
-        state["strip_brightness"] = brightness
-        if changed:
-            apply_steady_state()
-        publish_mqtt_state(force=True)
-    elif topic == MQTT_TOPIC_CMD_COLORTEMP:
-        log_memory("mqtt cmd colortemp", force=True)
-        try:
-            colortemp_value = int(float(payload))
-        except ValueError:
-            print("MQTT: invalid colortemp '%s'" % payload)
-            return
-        colortemp_value = int(clamp(colortemp_value, COLORTEMP_MIN, COLORTEMP_MAX))
-        print("MQTT: colortemp -> %d" % colortemp_value)
-        changed = state["strip_colortemp"] != colortemp_value
-        state["strip_colortemp"] = colortemp_value
-        if changed:
-            apply_steady_state()
-        publish_mqtt_state(force=True)
-    elif topic == MQTT_TOPIC_CMD_FIRE:
-        log_memory("mqtt cmd fire", force=True)
-        if payload == "1":
-            print("MQTT: fire command")
-            if request_fire("mqtt"):
-                try:
-                    if _mqtt_client:
-                        # Blink on (optional), then OFF so UI acts momentary
-                        _mqtt_client.publish(MQTT_TOPIC_STATE_FIRE, b"1", retain=False)
-                except Exception as exc:
-                    print("MQTT fire state publish failed:", exc)
 
-                # small async delay before resetting OFF so HomeKit can show the toggle
-                async def _reset_fire():
-                    await asyncio.sleep_ms(200)
-                    try:
-                        if _mqtt_client:
-                            _mqtt_client.publish(MQTT_TOPIC_STATE_FIRE, b"0", retain=True)
-                    except Exception as exc:
-                        print("MQTT fire reset failed:", exc)
+def _wait_readable(sock):
+    # Park the task in the uasyncio poller until sock has data, the same way
+    # uasyncio's own Stream.read waits.
+    yield asyncio.core._io_queue.queue_read(sock)
 
-                asyncio.create_task(_reset_fire())
-            else:
-                print("MQTT: fire ignored; busy or delayed")
+
+async def _wait_mqtt_input(client, timeout_ms):
+    # Wake as soon as the broker sends something instead of polling
+    # check_msg(); timeout_ms (0 = none) brings the loop back for pings.
+    sock = getattr(client, "sock", None)
+    if sock is None:
+        await asyncio.sleep_ms(100)
+        return
+    try:
+        if timeout_ms > 0:
+            await asyncio.wait_for_ms(_wait_readable(sock), timeout_ms)
         else:
-            print("MQTT: fire ignored payload '%s'" % payload)
+            await _wait_readable(sock)
+    except asyncio.TimeoutError:
+        pass
+
+
+# Link state from the last Wi-Fi check, readable without another call into the
+# driver. Set by ensure_wifi_ready(); cleared by mqtt_loop when the broker
+# connection fails so the link is re-read before the next attempt.
+_wifi_connected = False
+
+
+def _wifi_link_up():
+    global _wifi_connected
+    if not _wifi_connected:
+        try:
+            import network
+
+            _wifi_connected = network.WLAN(network.STA_IF).isconnected()
+        except Exception:
+            _wifi_connected = True  # no way to tell; let connect() find out
+    return _wifi_connected
 
 
 async def mqtt_loop():
-    global _mqtt_client
+    global _mqtt_client, _wifi_connected
 
     if MQTTClientClass is None:
         print("MQTT client library not available; MQTT disabled")
@@ -711,7 +1078,10 @@ async def mqtt_loop():
     print("MQTT using %s" % MQTT_CLIENT_IMPL)
     log_memory("mqtt init", force=True, collect=True)
 
+    ticks_ms = utime.ticks_ms
+    ticks_diff = utime.ticks_diff
     client = None
+    ping = None
     ping_interval_ms = 0
     if MQTT_KEEPALIVE:
         ping_interval_ms = int(MQTT_KEEPALIVE * 1000 / 2)
@@ -720,6 +1090,10 @@ async def mqtt_loop():
 
     while True:
         if client is None:
+            if not _wifi_link_up():
+                # No link: a connect attempt would only time out in the socket.
+                await asyncio.sleep(MQTT_RECONNECT_DELAY_S)
+                continue
             try:
                 client = MQTTClientClass(
                     MQTT_CLIENT_ID,
@@ -730,6 +1104,9 @@ async def mqtt_loop():
                 client.set_callback(mqtt_message)
                 client.connect()
                 _touch_mqtt_activity()
+                # Resolved once per connection; None when keepalive is off or
+                # the client library has no ping().
+                ping = getattr(client, "ping", None) if ping_interval_ms else None
                 for topic in MQTT_SUB_TOPICS:
                     client.subscribe(topic)
                 _mqtt_client = client
@@ -742,6 +1119,7 @@ async def mqtt_loop():
                 client = None
                 _mqtt_client = None
                 _reset_mqtt_state_cache()
+                _wifi_connected = False
                 await asyncio.sleep(MQTT_RECONNECT_DELAY_S)
                 continue
 
@@ -757,14 +1135,14 @@ async def mqtt_loop():
             client = None
             _mqtt_client = None
             _reset_mqtt_state_cache()
+            _wifi_connected = False
             await asyncio.sleep(MQTT_RECONNECT_DELAY_S)
             continue
 
-        if ping_interval_ms and hasattr(client, "ping"):
-            now = utime.ticks_ms()
-            if utime.ticks_diff(now, _mqtt_last_activity) >= ping_interval_ms:
+        if ping is not None:
+            if ticks_diff(ticks_ms(), _mqtt_last_activity) >= ping_interval_ms:
                 try:
-                    client.ping()
+                    ping()
                     _touch_mqtt_activity()
                 except Exception as exc:
                     print("MQTT ping failed:", exc)
@@ -776,10 +1154,16 @@ async def mqtt_loop():
                     client = None
                     _mqtt_client = None
                     _reset_mqtt_state_cache()
+                    _wifi_connected = False
                     await asyncio.sleep(MQTT_RECONNECT_DELAY_S)
                     continue
 
-        await asyncio.sleep_ms(100)
+        wait_ms = 0
+        if ping is not None:
+            wait_ms = ping_interval_ms - ticks_diff(ticks_ms(), _mqtt_last_activity)
+            if wait_ms < 1:
+                wait_ms = 1
+        await _wait_mqtt_input(client, wait_ms)
 
 
 TEMPLATE_PATH = "template.html"
@@ -789,6 +1173,113 @@ TEMPLATE_ERROR_HTML = (
 )
 
 
+_template_cache = None
+
+
+def _compile_template(text):
+    # Split a str.format template into (literal, field name, field format)
+    # segments plus a trailing literal, resolving {{ and }} escapes up front so
+    # rendering only has to look up and format the fields.
+    segments = []
+    pending = []
+    i = 0
+    while True:
+        open_at = text.find("{", i)
+        close_at = text.find("}", i)
+        if open_at < 0 and close_at < 0:
+            pending.append(text[i:])
+            break
+        if close_at >= 0 and (open_at < 0 or close_at < open_at):
+            if text[close_at + 1 : close_at + 2] != "}":
+                raise ValueError("Single '}' in template")
+            pending.append(text[i : close_at + 1])
+            i = close_at + 2
+            continue
+        if text[open_at + 1 : open_at + 2] == "{":
+            pending.append(text[i : open_at + 1])
+            i = open_at + 2
+            continue
+        end = text.find("}", open_at)
+        if end < 0:
+            raise ValueError("Single '{' in template")
+        pending.append(text[i:open_at])
+        field = text[open_at + 1 : end]
+        colon = field.find(":")
+        if colon >= 0:
+            segments.append(("".join(pending), field[:colon], "{" + field[colon:] + "}"))
+        else:
+            segments.append(("".join(pending), field, None))
+        pending = []
+        i = end + 1
+    return segments, "".join(pending)
+
+
+def _load_template():
+    # The template never changes at runtime, so read and compile it from flash
+    # once. A missing file is not cached, so uploading it later still takes
+    # effect.
+    global _template_cache
+    if _template_cache is None:
+        try:
+            with open(TEMPLATE_PATH, "r") as template_file:
+                _template_cache = _compile_template(template_file.read())
+        except (OSError, ValueError):
+            return None
+    return _template_cache
+
+
+def _fill_template(template, values):
+    segments, tail = template
+    out = []
+    for literal, name, field_format in segments:
+        out.append(literal)
+        value = values[name]
+        out.append(field_format.format(value) if field_format else str(value))
+    out.append(tail)
+    return "".join(out)
+
+
+def _build_http_header(response_code, content_type):
+    # Everything up to the Content-Length value, which is the only per-response
+    # part of the head.
+    return (
+        "HTTP/1.0 %s\r\nContent-Type: %s\r\nConnection: close\r\nContent-Length: "
+        % (response_code, content_type)
+    ).encode()
+
+
+# Every status/content-type pair the route handlers return, rendered once.
+HTTP_HEADERS = {
+    pair: _build_http_header(*pair)
+    for pair in (
+        ("200 OK", "text/html"),
+        ("200 OK", "application/json"),
+        ("409 Conflict", "text/html"),
+        ("409 Conflict", "application/json"),
+        ("400 Bad Request", "text/plain"),
+        ("431 Request Header Fields Too Large", "text/plain"),
+    )
+}
+
+# Sent instead of dispatching when the request could not be read in full.
+HTTP_BAD_REQUEST = ("400 Bad Request", "text/plain", b"Bad request\n")
+HTTP_HEAD_TOO_LARGE = (
+    "431 Request Header Fields Too Large",
+    "text/plain",
+    b"Request header too large\n",
+)
+
+
+async def _send_response(writer, response_code, content_type, body):
+    header = HTTP_HEADERS.get((response_code, content_type))
+    if header is None:
+        header = _build_http_header(response_code, content_type)
+    # One write per response instead of one per header line. The length
+    # lets clients finish without waiting for the close.
+    writer.write(b"".join((header, str(len(body)).encode(), b"\r\n\r\n", body)))
+    await writer.drain()
+
+
 def render_index():
     params = state["params"]
 
@@ -800,24 +1291,6 @@ def render_index():
     brightness_value = state["strip_brightness"]
     brightness_percent = brightness_to_percent(brightness_value)
 
-    def get_param_attrs(key):
-        value = params.get(key)
-        if value is None and key in ("BURST_GAP_MIN_MS", "BURST_GAP_MAX_MS"):
-            value = params.get("BURST_GAP_MS")
-        if value is None:
-            value = 0
-        caster = PARAM_TYPES.get(key)
-        if caster is int:
-            step = "1"
-            inputmode = "numeric"
-        elif caster is float:
-            step = "0.001"
-            inputmode = "decimal"
-        else:
-            step = "0.001"
-            inputmode = "decimal"
-        return format_number(value), step, inputmode
-
     brightness_factor = params.get("BRIGHTNESS_FACTOR", 0.25)
     try:
         brightness_factor = float(brightness_factor)
@@ -857,12 +1330,6 @@ def render_index():
         temperature_percent = 100
     temperature_output = "{}% warm".format(temperature_percent)
 
-    def store_attrs(target, key, prefix):
-        value, step, inputmode = get_param_attrs(key)
-        target[prefix + "_value"] = value
-        target[prefix + "_step"] = step
-        target[prefix + "_inputmode"] = inputmode
-
     format_kwargs = {
         "hidden_fields": '<input type="hidden" name="strip_on" value="off">',
         "strip_on_checked": " checked" if state["strip_on"] else "",
@@ -882,51 +1349,82 @@ def render_index():
         "param_bounce_checked": " checked" if params.get("BOUNCE") else "",
     }
 
-    store_attrs(format_kwargs, "DELAY_MIN", "param_delay_min")
-    store_attrs(format_kwargs, "DELAY_MAX", "param_delay_max")
-    store_attrs(format_kwargs, "TRAIL_MIN", "param_trail_min")
-    store_attrs(format_kwargs, "TRAIL_MAX", "param_trail_max")
-    store_attrs(format_kwargs, "MIN_ENDPOINT", "param_endpoint_min")
-    store_attrs(format_kwargs, "MAX_ENDPOINT", "param_endpoint_max")
-    store_attrs(format_kwargs, "MIN_MOTION_WAIT", "param_motion_wait_min")
-    store_attrs(format_kwargs, "MAX_MOTION_WAIT", "param_motion_wait_max")
-    store_attrs(format_kwargs, "BURST_GAP_MIN_MS", "param_burst_gap_min")
-    store_attrs(format_kwargs, "BURST_GAP_MAX_MS", "param_burst_gap_max")
-    format_kwargs["param_burst_gap_step"] = format_kwargs.get("param_burst_gap_min_step", "0.001")
-    format_kwargs["param_burst_gap_inputmode"] = format_kwargs.get("param_burst_gap_min_inputmode", "decimal")
+    format_kwargs.update(_PARAM_FIELD_ATTRS)
+    for key, value_name in _PARAM_FIELDS:
+        value = params.get(key)
+        if value is None and key in ("BURST_GAP_MIN_MS", "BURST_GAP_MAX_MS"):
+            value = params.get("BURST_GAP_MS")
+        if value is None:
+            value = 0
+        format_kwargs[value_name] = format_number(value)
 
-    try:
-        with open(TEMPLATE_PATH, "r") as template_file:
-            template = template_file.read()
-    except OSError:
+    template = _load_template()
+    if template is None:
         return TEMPLATE_ERROR_HTML
 
     try:
-        return template.format(**format_kwargs)
+        return _fill_template(template, format_kwargs)
     except (KeyError, IndexError, ValueError):
         return TEMPLATE_ERROR_HTML
 
 
-def urldecode(value: str) -> str:
-    result = []
+_index_page = None
+_index_page_version = -1
+
+
+def render_index_page():
+    # The page only depends on state, so serve the last rendering (already
+    # encoded) until touch_state_version() marks it stale.
+    global _index_page, _index_page_version
+    if _index_page is None or _index_page_version != _state_version:
+        html = render_index()
+        if html is TEMPLATE_ERROR_HTML:
+            return html.encode()
+        _index_page = html.encode()
+        _index_page_version = _state_version
+    return _index_page
+
+
+# Hex digit value for every byte, 0xFF for anything that is not a hex digit.
+_HEX_NIBBLE = bytearray(b"\xff" * 256)
+for _digit in range(10):
+    _HEX_NIBBLE[0x30 + _digit] = _digit
+for _digit in range(6):
+    _HEX_NIBBLE[0x41 + _digit] = 10 + _digit
+    _HEX_NIBBLE[0x61 + _digit] = 10 + _digit
+del _digit
+
+
+# Scratch space for urldecode, grown to the longest escaped value seen. Safe to
+# share: urldecode never awaits, so no other caller can run mid-decode.
+_urldecode_buf = bytearray(64)
+
+
+def urldecode(src: bytes) -> str:
+    global _urldecode_buf
+    if b"%" not in src and b"+" not in src:
+        return src.decode()
+    length = len(src)
+    out = _urldecode_buf
+    if len(out) < length:
+        out = _urldecode_buf = bytearray(length)
+    hex_nibble = _HEX_NIBBLE
     i = 0
-    length = len(value)
+    j = 0
     while i < length:
-        ch = value[i]
-        if ch == "+":
-            result.append(" ")
-            i += 1
-        elif ch == "%" and i + 2 < length:
-            try:
-                result.append(chr(int(value[i + 1 : i + 3], 16)))
-                i += 3
-            except ValueError:
-                result.append(ch)
-                i += 1
-        else:
-            result.append(ch)
-            i += 1
-    return "".join(result)
+        ch = src[i]
+        if ch == 0x2B:  # "+"
+            ch = 0x20
+        elif ch == 0x25 and i + 2 < length:  # "%"
+            high = hex_nibble[src[i + 1]]
+            low = hex_nibble[src[i + 2]]
+            if high < 16 and low < 16:
+                ch = (high << 4) | low
+                i += 2
+        out[j] = ch
+        i += 1
+        j += 1
+    return str(memoryview(out)[:j], "utf-8")
 
 
 def parse_bool(value):
@@ -951,180 +1449,363 @@ PARAM_TYPES = {
     "BURST_GAP_MS": float,
 }
 
+# Checkbox params: an unticked box is simply absent from the form data.
+_BOOL_PARAM_KEYS = tuple(k for k, v in PARAM_TYPES.items() if v is parse_bool)
+
 STATE_PARAM_TYPES = {
     "strip_on": parse_bool,
     "strip_brightness": float,
     "strip_colortemp": int,
 }
 
+# Every accepted form key, as the raw bytes the parser sees, -> (key, caster,
+# is_strip_setting), so a pair needs one lookup and no decode to be matched.
+# PARAM_TYPES wins if a key were ever in both tables.
+_FORM_FIELDS = {
+    key.encode(): (key, caster, True) for key, caster in STATE_PARAM_TYPES.items()
+}
+_FORM_FIELDS.update(
+    (key.encode(), (key, caster, False)) for key, caster in PARAM_TYPES.items()
+)
+
+# Numeric animation fields on the index page: (param key, template prefix).
+_PARAM_FIELD_PREFIXES = (
+    ("DELAY_MIN", "param_delay_min"),
+    ("DELAY_MAX", "param_delay_max"),
+    ("TRAIL_MIN", "param_trail_min"),
+    ("TRAIL_MAX", "param_trail_max"),
+    ("MIN_ENDPOINT", "param_endpoint_min"),
+    ("MAX_ENDPOINT", "param_endpoint_max"),
+    ("MIN_MOTION_WAIT", "param_motion_wait_min"),
+    ("MAX_MOTION_WAIT", "param_motion_wait_max"),
+    ("BURST_GAP_MIN_MS", "param_burst_gap_min"),
+    ("BURST_GAP_MAX_MS", "param_burst_gap_max"),
+)
+
+
+def _build_param_fields():
+    # The step/inputmode attributes only depend on each field's type, so
+    # they are worked out once here; render_index only formats the values.
+    fields = []
+    attrs = {}
+    for key, prefix in _PARAM_FIELD_PREFIXES:
+        if PARAM_TYPES.get(key) is int:
+            step = "1"
+            inputmode = "numeric"
+        else:
+            step = "0.001"
+            inputmode = "decimal"
+        fields.append((key, prefix + "_value"))
+        attrs[prefix + "_step"] = step
+        attrs[prefix + "_inputmode"] = inputmode
+    attrs["param_burst_gap_step"] = attrs["param_burst_gap_min_step"]
+    attrs["param_burst_gap_inputmode"] = attrs["param_burst_gap_min_inputmode"]
+    return tuple(fields), attrs
+
+
+_PARAM_FIELDS, _PARAM_FIELD_ATTRS = _build_param_fields()
+
+HTTP_HEAD_LIMIT = const(2048)
+
+# Reused for the request head of whichever connection gets it first; a client
+# that arrives while it is taken reads into a buffer of its own.
+_http_head_buf = memoryview(bytearray(HTTP_HEAD_LIMIT))
+_http_head_buf_free = True
+
+
+@micropython.viper
+def _find_head_end(buf, start: int, end: int) -> int:
+    # Offset of the first b"\r\n\r\n" in buf[start:end], or -1.
+    p = ptr8(buf)
+    i = start
+    last = end - 3
+    while i < last:
+        if p[i] == 13 and p[i + 1] == 10 and p[i + 2] == 13 and p[i + 3] == 10:
+            return i
+        i += 1
+    return -1
+
+
+async def _read_request_head(reader):
+    # Read straight into a preallocated buffer until the blank line that ends
+    # the headers. Returns the bytes read so far (which may include the start
+    # of the body) and the offset of the blank line, or -1 if it never came
+    # (head over HTTP_HEAD_LIMIT, or the client stopped sending).
+    global _http_head_buf_free
+    shared = _http_head_buf_free
+    if shared:
+        _http_head_buf_free = False
+        buf = _http_head_buf
+    else:
+        buf = memoryview(bytearray(HTTP_HEAD_LIMIT))
+    try:
+        count = 0
+        while count < HTTP_HEAD_LIMIT:
+            got = await reader.readinto(buf[count:])
+            if not got:
+                break
+            # Step back 3 so a terminator split across reads is still found.
+            end = _find_head_end(buf, max(0, count - 3), count + got)
+            count += got
+            if end >= 0:
+                return bytes(buf[:count]), end
+        return bytes(buf[:count]), -1
+    finally:
+        if shared:
+            _http_head_buf_free = True
+
+
+def _parse_form_pairs(data, updates, state_updates):
+    # Single pass over b"k=v&k=v" data (query string or raw POST body),
+    # walking the separators by index so no list of pairs is built and only
+    # the key/value slices are decoded; returns True if it held any pair.
+    seen = False
+    end = len(data)
+    start = 0
+    while start < end:
+        amp = data.find(b"&", start)
+        if amp < 0:
+            amp = end
+        if amp > start:
+            seen = True
+            eq = data.find(b"=", start, amp)
+            if eq >= 0:
+                # Known keys are plain identifiers, so the raw key slice is
+                # looked up as-is and only an escaped key goes through
+                # urldecode. The value is decoded only for a matched key.
+                # UnicodeError from a bad slice is a ValueError.
+                raw_key = data[start:eq]
+                if b"%" in raw_key or b"+" in raw_key:
+                    try:
+                        raw_key = urldecode(raw_key).encode()
+                    except ValueError:
+                        raw_key = b""
+                field = _FORM_FIELDS.get(raw_key)
+                if field is not None:
+                    key, caster, is_strip_setting = field
+                    target = state_updates if is_strip_setting else updates
+                    value = None
+                    try:
+                        value = urldecode(data[eq + 1 : amp])
+                        target[key] = caster(value)
+                    except ValueError:
+                        print("Failed to parse", key, value)
+        start = amp + 1
+    return seen
+
+
+def _http_set(method, query, body_bytes):
+    updates = {}
+    state_updates = {}
+    seen = False
+    if query:
+        seen = _parse_form_pairs(query, updates, state_updates)
+    if method == "POST" and body_bytes:
+        if _parse_form_pairs(body_bytes, updates, state_updates):
+            seen = True
+    if seen:
+        for key in _BOOL_PARAM_KEYS:
+            if key not in updates:
+                updates[key] = False
+    params_changed = False
+    if updates:
+        state["params"].update(updates)
+        print("Updated params via HTTP:", updates)
+        params_changed = True
+    strip_changes = {}
+    if state_updates:
+        # Only values that differ from the current state count as changes, so
+        # resubmitting the form does not repaint, bump the version or publish.
+        if "strip_on" in state_updates:
+            strip_on = bool(state_updates["strip_on"])
+            if strip_on != state["strip_on"]:
+                state["strip_on"] = strip_on
+                strip_changes["strip_on"] = strip_on
+        if "strip_brightness" in state_updates:
+            brightness = state_updates["strip_brightness"]
+            if brightness != brightness:
+                # nan fails every comparison, so the clamp would let it through.
+                print("Ignoring non-numeric strip_brightness")
+            else:
+                if brightness < 0.0:
+                    brightness = 0.0
+                elif brightness > 1.0:
+                    brightness = 1.0
+                if brightness != state["strip_brightness"]:
+                    state["strip_brightness"] = brightness
+                    strip_changes["strip_brightness"] = brightness
+        if "strip_colortemp" in state_updates:
+            colortemp = state_updates["strip_colortemp"]
+            if colortemp < COLORTEMP_MIN:
+                colortemp = COLORTEMP_MIN
+            elif colortemp > COLORTEMP_MAX:
+                colortemp = COLORTEMP_MAX
+            if colortemp != state["strip_colortemp"]:
+                state["strip_colortemp"] = colortemp
+                strip_changes["strip_colortemp"] = colortemp
+        if strip_changes:
+            print("Updated strip settings via HTTP:", strip_changes)
+            _invalidate_base_color()
+    if params_changed or strip_changes:
+        touch_state_version()
+        request_steady_state()
+        mark_state_changed()
+    if strip_changes:
+        request_state_publish()
+    if method == "POST":
+        return "200 OK", "application/json", b"{\"status\":\"ok\"}"
+    return "200 OK", "text/html", b"<html><body><p>Parameters updated.</p><p><a href=\"/\">Back</a></p></body></html>"
+
+
+def _http_fire(method, query, body_bytes):
+    if request_fire("http"):
+        if method == "POST":
+            return "200 OK", "application/json", b"{\"status\":\"fired\"}"
+        return "200 OK", "text/html", b"<html><body><p>FIRE triggered.</p><p><a href=\"/\">Back</a></p></body></html>"
+    if method == "POST":
+        return "409 Conflict", "application/json", b"{\"status\":\"ignored\"}"
+    return "409 Conflict", "text/html", b"<html><body><p>FIRE ignored (busy).</p><p><a href=\"/\">Back</a></p></body></html>"
+
+
+def _http_index(method, query, body_bytes):
+    return "200 OK", "text/html", render_index_page()
+
+
+# Exact paths (query string stripped); anything else gets the index page.
+HTTP_ROUTES = {
+    "/set": _http_set,
+    "/fire": _http_fire,
+}
+
+
+# Older uasyncio streams lack wait_closed(); check once rather than catching
+# AttributeError on every connection.
+_HAS_WAIT_CLOSED = hasattr(asyncio.StreamWriter, "wait_closed")
+
+
+_LOG_MEM_EVERY = const(32)
+_http_req_count = 0
+
+
 async def handle_http_client(reader, writer):
+    global _http_req_count
     method = "<unknown>"
     path = "<unknown>"
     try:
-        request_line = await reader.readline()
-        if not request_line:
+        head, head_end = await _read_request_head(reader)
+        if not head:
             return
-        request_line = request_line.decode().strip()
-        if not request_line:
+        if head_end < 0:
+            # Never act on a partial head: the truncated part may hold the
+            # Content-Length, so the body would be silently dropped.
+            if len(head) >= HTTP_HEAD_LIMIT:
+                await _send_response(writer, *HTTP_HEAD_TOO_LARGE)
+            else:
+                await _send_response(writer, *HTTP_BAD_REQUEST)
             return
-
-        parts = request_line.split()
+        lines = head[:head_end].split(b"\r\n")
+        parts = lines[0].split()
         if len(parts) < 2:
             return
 
-        method = parts[0].upper()
-        path = parts[1]
-        log_memory("http start %s %s" % (method, path), force=True)
+        method = parts[0].decode().upper()
+        target = parts[1]
+        path = target.decode()
+        if ENABLE_MEMORY_DEBUG:
+            log_memory("http start %s %s" % (method, path), force=True)
 
         content_length = 0
-        while True:
-            header = await reader.readline()
-            if not header or header == b"\r\n":
-                break
-            header_str = header.decode().strip()
-            if header_str.lower().startswith("content-length:"):
+        for header in lines[1:]:
+            # Headers stay bytes; only Content-Length is ever looked at.
+            if header[:15].lower() == b"content-length:":
                 try:
-                    content_length = int(header_str.split(":", 1)[1].strip())
+                    content_length = int(header[15:].strip())
                 except ValueError:
                     pass
 
         body_bytes = b""
         if content_length:
-            try:
-                body_bytes = await reader.readexactly(content_length)
-            except Exception:
-                body_bytes = b""
-
-        response_code = "200 OK"
-        body = ""
-        content_type = "text/html"
-
-        if path.startswith("/set"):
-            query = ""
-            if "?" in path:
-                path, query = path.split("?", 1)
-            updates = {}
-            state_updates = {}
-            raw_pairs = []
-            if query:
-                raw_pairs.extend([pair for pair in query.split("&") if pair])
-            if method == "POST" and body_bytes:
+            body_bytes = head[head_end + 4 : head_end + 4 + content_length]
+            missing = content_length - len(body_bytes)
+            if missing > 0:
                 try:
-                    post_data = body_bytes.decode()
+                    body_bytes += await reader.readexactly(missing)
                 except Exception:
-                    post_data = ""
-                if post_data:
-                    raw_pairs.extend([pair for pair in post_data.split("&") if pair])
-            if raw_pairs:
-                for pair in raw_pairs:
-                    if "=" in pair:
-                        key, value = pair.split("=", 1)
-                        key = urldecode(key)
-                        value = urldecode(value)
-                        if key in PARAM_TYPES:
-                            caster = PARAM_TYPES[key]
-                            try:
-                                updates[key] = caster(value)
-                            except ValueError:
-                                print("Failed to parse", key, value)
-                        elif key in STATE_PARAM_TYPES:
-                            caster = STATE_PARAM_TYPES[key]
-                            try:
-                                state_updates[key] = caster(value)
-                            except ValueError:
-                                print("Failed to parse", key, value)
-                bool_keys = [k for k, v in PARAM_TYPES.items() if v is parse_bool]
-                for key in bool_keys:
-                    if key not in updates:
-                        updates[key] = False
-            params_changed = False
-            if updates:
-                new_params = state["params"].copy()
-                new_params.update(updates)
-                state["params"] = new_params
-                print("Updated params via HTTP:", updates)
-                params_changed = True
-            strip_changes = {}
-            if state_updates:
-                if "strip_on" in state_updates:
-                    state["strip_on"] = bool(state_updates["strip_on"])
-                    strip_changes["strip_on"] = state["strip_on"]
-                if "strip_brightness" in state_updates:
-                    brightness = max(0.0, min(1.0, state_updates["strip_brightness"]))
-                    state["strip_brightness"] = brightness
-                    strip_changes["strip_brightness"] = brightness
-                if "strip_colortemp" in state_updates:
-                    colortemp = int(clamp(state_updates["strip_colortemp"], COLORTEMP_MIN, COLORTEMP_MAX))
-                    state["strip_colortemp"] = colortemp
-                    strip_changes["strip_colortemp"] = colortemp
-                if strip_changes:
-                    print("Updated strip settings via HTTP:", strip_changes)
-            if params_changed or strip_changes:
-                apply_steady_state()
-                mark_state_changed()
-            if strip_changes:
-                publish_mqtt_state(force=True)
-            if method == "POST":
-                body = "{\"status\":\"ok\"}"
-                content_type = "application/json"
-            else:
-                body = "<html><body><p>Parameters updated.</p><p><a href=\"/\">Back</a></p></body></html>"
-        elif path.startswith("/fire"):
-            if request_fire("http"):
-                if method == "POST":
-                    body = "{\"status\":\"fired\"}"
-                    content_type = "application/json"
-                else:
-                    body = "<html><body><p>FIRE triggered.</p><p><a href=\"/\">Back</a></p></body></html>"
-            else:
-                response_code = "409 Conflict"
-                if method == "POST":
-                    body = "{\"status\":\"ignored\"}"
-                    content_type = "application/json"
-                else:
-                    body = "<html><body><p>FIRE ignored (busy).</p><p><a href=\"/\">Back</a></p></body></html>"
+                    # Short body: refuse rather than apply a partial form.
+                    await _send_response(writer, *HTTP_BAD_REQUEST)
+                    return
+
+        # The query stays bytes; _parse_form_pairs decodes only what it uses.
+        query_at = target.find(b"?")
+        if query_at >= 0:
+            route = target[:query_at].decode()
+            query = target[query_at + 1 :]
         else:
-            body = render_index()
-
-        writer.write(("HTTP/1.0 %s\r\n" % response_code).encode())
-        writer.write(("Content-Type: %s\r\n" % content_type).encode())
-        writer.write(b"Connection: close\r\n\r\n")
-        writer.write(body.encode())
-        await writer.drain()
+            route = path
+            query = b""
+        handler = HTTP_ROUTES.get(route, _http_index)
+        await _send_response(writer, *handler(method, query, body_bytes))
     except Exception as exc:
         print("HTTP client error:", exc)
-        log_memory("http error %s" % exc.__class__.__name__, force=True, collect=True)
+        if ENABLE_MEMORY_DEBUG:
+            log_memory("http error %s" % exc.__class__.__name__, force=True, collect=True)
     finally:
         try:
             writer.close()
-        except AttributeError:
-            pass
-        try:
-            await writer.wait_closed()
-        except AttributeError:
+            if _HAS_WAIT_CLOSED:
+                await writer.wait_closed()
+        except Exception:
             pass
 
-        log_memory("http end %s %s" % (method, path), force=True, collect=True)
+        if ENABLE_MEMORY_DEBUG:
+            # Collecting after every connection stalls the loop during slider
+            # drags; only every _LOG_MEM_EVERY-th request pays for it.
+            _http_req_count += 1
+            if _http_req_count % _LOG_MEM_EVERY == 0:
+                log_memory("http end %s %s" % (method, path), force=True, collect=True)
+
+
+# Long-lived tasks park on this instead of waking on a timer; setting it stops
+# the HTTP server and lets main() return.
+_shutdown = asyncio.Event()
 
 
 async def http_server():
     server = await asyncio.start_server(handle_http_client, "0.0.0.0", 80)
     print("HTTP server listening on port 80")
     log_memory("http server ready", force=True, collect=True)
-    while True:
-        await asyncio.sleep(3600)
+    await _shutdown.wait()
+    server.close()
 
 
 async def ensure_wifi_ready(timeout_s=10):
+    global _wifi_connected
     try:
         import network
 
         wlan = network.WLAN(network.STA_IF)
-        start = utime.ticks_ms()
-        timeout_ms = int(timeout_s * 1000)
-        while not wlan.isconnected() and utime.ticks_diff(utime.ticks_ms(), start) < timeout_ms:
-            await asyncio.sleep_ms(200)
-        if wlan.isconnected():
+        # Statuses the radio will not recover from by waiting longer.
+        failed = [
+            getattr(network, name)
+            for name in ("STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_CONNECT_FAIL")
+            if hasattr(network, name)
+        ]
+        deadline = utime.ticks_add(utime.ticks_ms(), int(timeout_s * 1000))
+        delay = 10
+        connected = wlan.isconnected()
+        while not connected:
+            status = wlan.status()
+            if status in failed:
+                print("Wi-Fi connect failed, status", status)
+                break
+            remaining = utime.ticks_diff(deadline, utime.ticks_ms())
+            if remaining <= 0:
+                break
+            await asyncio.sleep_ms(min(delay, remaining))
+            delay = min(delay * 2, 500)
+            connected = wlan.isconnected()
+        _wifi_connected = connected
+        if connected:
             print("Wi-Fi ready:", wlan.ifconfig())
         else:
             print("Wi-Fi not connected")
@@ -1133,6 +1814,20 @@ async def ensure_wifi_ready(timeout_s=10):
 
 
 async def main():
+    # The strip and the local tasks need no network, so they run while the
+    # Wi-Fi wait below is still in progress.
+    apply_steady_state(force=True)
+    log_memory("steady state applied", force=True, collect=True)
+
+    asyncio.create_task(animation_consumer())
+    asyncio.create_task(steady_update_task())
+    asyncio.create_task(steady_refresh_task())
+    asyncio.create_task(motion_poller())
+    asyncio.create_task(_fire_reset_task())
+    if ENABLE_MEMORY_DEBUG:
+        asyncio.create_task(memory_monitor())
+    asyncio.create_task(state_saver_task())
+
     await ensure_wifi_ready()
     log_memory("post wifi check", force=True, collect=True)
 
@@ -1147,20 +1842,12 @@ async def main():
             print("Failed to start WebREPL:", exc)
             log_memory("webrepl failed", force=True, collect=True)
 
-    apply_steady_state(force=True)
-    log_memory("steady state applied", force=True, collect=True)
-
-    asyncio.create_task(animation_consumer())
-    asyncio.create_task(steady_refresh_task())
-    asyncio.create_task(motion_poller())
     asyncio.create_task(mqtt_loop())
+    asyncio.create_task(state_publisher_task())
     asyncio.create_task(http_server())
-    asyncio.create_task(memory_monitor())
-    asyncio.create_task(state_saver_task())
     log_memory("tasks scheduled", force=True, collect=True)
 
-    while True:
-        await asyncio.sleep(60)
+    await _shutdown.wait()
 
 
 try: